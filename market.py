@@ -1,19 +1,32 @@
+import asyncio
 import datetime
 import logging.config
 from environs import Env
 from seller import download_stock
 
+import aiohttp
 import requests
 
-from seller import divide, price_conversion
+from net import close_session, get_session, send_json
+from seller import divide, parse_remnants
 
 logger = logging.getLogger(__file__)
 
+_YM_BASE = "https://api.partner.market.yandex.ru/"
+_OFFER_MAPPING_URL = _YM_BASE + "campaigns/{cid}/offer-mapping-entries"
+_STOCKS_URL = _YM_BASE + "campaigns/{cid}/offers/stocks"
+_PRICES_URL = _YM_BASE + "campaigns/{cid}/offer-prices/updates"
 
-def get_product_list(page, campaign_id, access_token):
+# Максимальное число товаров в одном запросе, допустимое API
+YM_STOCKS_BATCH = 2000
+YM_PRICES_BATCH = 500
+
+
+async def get_product_list(session, page, campaign_id, access_token):
     """Получить список товаров с Яндекс Маркета
 
     Args:
+        session (aiohttp.ClientSession): HTTP-сессия
         page (str): Страница на котором получен последний товар
         campaign_id (str): Идентификатор кампании
         access_token (str): Токен продавца
@@ -22,36 +35,30 @@ def get_product_list(page, campaign_id, access_token):
         dict: Возвращает словарь содержащий список товаров
         
     Raises:
-        requests.exceptions.HTTPError: Если HTTP-запрос завершился с ошибкой
+        aiohttp.ClientResponseError: Если HTTP-запрос завершился с ошибкой
         ValueError: Если обязательные параметры не переданы или имеют неверный тип
+        KeyError: Если ответ сервера не соответствует ожидаемой схеме
 
     Examples:
-        >>> get_product_list("123", "campaign_456", "access_token_789")
+        >>> await get_product_list(session, "123", "campaign_456", "access_token_789")
         [{'offer': {'shopSku': 'sku_1'}, ...}, {'offer': {'shopSku': 'sku_2'}, ...}]  
         
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {
         "page_token": page,
         "limit": 200,
     }
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object.get("result")
+    url = _OFFER_MAPPING_URL.format(cid=campaign_id)
+    response_object = await send_json(session, "GET", url, None, headers, payload)
+    return response_object["result"]
 
 
-def update_stocks(stocks, campaign_id, access_token):
+async def update_stocks(session, stocks, campaign_id, access_token):
     """Обновить остатки
 
     Args:
+        session (aiohttp.ClientSession): HTTP-сессия
         stocks (list): Список словарей с информацией об остатках
         campaign_id (str): Идентификатор кампании
         access_token (str): Токен продавца
@@ -60,7 +67,7 @@ def update_stocks(stocks, campaign_id, access_token):
         dict: Приходит ответ от сервера с информацией об обновлённых остатках
 
     Raisis:
-        requests.exceptions.HTTPError: Если HTTP-запрос завершился неудачно
+        aiohttp.ClientResponseError: Если HTTP-запрос завершился неудачно
 
     Examples:
         >>> stocks = {
@@ -74,29 +81,21 @@ def update_stocks(stocks, campaign_id, access_token):
                         }
                     ],
                 }
-        >>> update_stocks(stocks, "campaign_456", "access_token_789")
+        >>> await update_stocks(session, stocks, "campaign_456", "access_token_789")
         {'status': 'success', ...}
         
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {"skus": stocks}
-    url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object
+    url = _STOCKS_URL.format(cid=campaign_id)
+    return await send_json(session, "PUT", url, payload, headers)
 
 
-def update_price(prices, campaign_id, access_token):
+async def update_price(session, prices, campaign_id, access_token):
     """Обновить цены товаров
 
     Args:
+        session (aiohttp.ClientSession): HTTP-сессия
         prices (list): Список словарей с информацией о цене товара
         campaign_id (str): Идентификатор кампании
         access_token (str): Токен доступа для аутентификации
@@ -105,7 +104,7 @@ def update_price(prices, campaign_id, access_token):
         dict: Приходит ответ от сервера с ифнормацией о новых ценах
         
     Raises:
-        requests.exceptions.HTTPError: Если HTTP-запрос завершился неудачно
+        aiohttp.ClientResponseError: Если HTTP-запрос завершился неудачно
 
     Examples:
         >>> prices = [
@@ -118,68 +117,67 @@ def update_price(prices, campaign_id, access_token):
                 },
                 ...
             ]
-        >>> update_price(prices, "campaign_456", "access_token_789")
+        >>> await update_price(session, prices, "campaign_456", "access_token_789")
         {'status': 'success', ...}
         
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {"offers": prices}
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object
+    url = _PRICES_URL.format(cid=campaign_id)
+    return await send_json(session, "POST", url, payload, headers)
 
 
-def get_offer_ids(campaign_id, market_token):
+async def get_offer_ids(session, campaign_id, market_token):
     """Получить артикулы товаров Яндекс маркета
 
     Args:
+        session (aiohttp.ClientSession): HTTP-сессия
         campaign_id (str): Идентификатор кампании
         market_token (str): Токен продавца
 
     Returns:
-        list: Возвращает список артикулов товаров
+        frozenset: Возвращает множество артикулов товаров
 
     Examples:
-        >>> get_offer_ids("campaign_456", "market_token_789")
-        ["123456", "123457", ...]
+        >>> await get_offer_ids(session, "campaign_456", "market_token_789")
+        frozenset({"123456", "123457", ...})
         
     """
     page = ""
     product_list = []
     while True:
-        some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
-        page = some_prod.get("paging").get("nextPageToken")
+        some_prod = await get_product_list(session, page, campaign_id, market_token)
+        product_list.extend(some_prod["offerMappingEntries"])
+        # На последней странице nextPageToken отсутствует
+        page = some_prod["paging"].get("nextPageToken")
         if not page:
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
-    return offer_ids
+    return frozenset(product["offer"]["shopSku"] for product in product_list)
+
+
+def _stock_row(sku, count, warehouse_id, date):
+    """Собрать запись об остатке товара на складе для API Яндекс Маркета"""
+    return {
+        "sku": sku,
+        "warehouseId": warehouse_id,
+        "items": [{"count": count, "type": "FIT", "updatedAt": date}],
+    }
 
 
 def create_stocks(watch_remnants, offer_ids, warehouse_id):
     """Создать список остатков для обновления
 
     Args:
-        watch_remnants (list): Список словарей с информацией об оставшихся часов
-        offer_ids (list):  Список артикулов товаров
+        watch_remnants (pd.DataFrame): Остатки часов, подготовленные parse_remnants
+        offer_ids (frozenset): Множество артикулов товаров
         warehouse_id (int): Идентификатор склада
 
     Returns:
-        list: Список словарей с информацией об остатках
+        tuple: Кортеж, содержащий полный список остатков и список непустых остатков
 
     Examples:
-        >>> create_stocks([...], ["sku_1", "sku_2"], 1)
-        [
+        >>> create_stocks(watch_remnants, frozenset({"sku_1", "sku_2"}), 1)
+        ([
             {
                 "sku": "sku_1",
                 "warehouseId": 1,
@@ -192,65 +190,39 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
                 ]
             },
             ...
-        ]
+        ], [...])
         
     """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    date = now.replace(microsecond=0, tzinfo=None).isoformat() + "Z"
     # Уберем то, что не загружено в market
-    stocks = list()
-    date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
-                {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
-                }
-            )
-            offer_ids.remove(str(watch.get("Код")))
+    remnants = watch_remnants[watch_remnants["code"].isin(offer_ids)]
+    remnants = remnants.drop_duplicates("code")
+    stocks = []
+    not_empty = []
+    for code, count in zip(remnants["code"], remnants["stock"].tolist()):
+        stock = _stock_row(code, count, warehouse_id, date)
+        stocks.append(stock)
+        if count != 0:
+            not_empty.append(stock)
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append(
-            {
-                "sku": offer_id,
-                "warehouseId": warehouse_id,
-                "items": [
-                    {
-                        "count": 0,
-                        "type": "FIT",
-                        "updatedAt": date,
-                    }
-                ],
-            }
-        )
-    return stocks
+    for offer_id in offer_ids.difference(remnants["code"]):
+        stocks.append(_stock_row(offer_id, 0, warehouse_id, date))
+    return stocks, not_empty
 
 
 def create_prices(watch_remnants, offer_ids):
     """Создать список цен
 
     Args:
-        watch_remnants (list): Список словарей с информацией об оставшихся часов
-        offer_ids (list): Список артикулов товаров
+        watch_remnants (pd.DataFrame): Остатки часов, подготовленные parse_remnants
+        offer_ids (frozenset): Множество артикулов товаров
 
     Returns:
         list: Список словарей с информацией о ценах
 
     Examples:
-        >>> create_prices([...], ["sku_1", "sku_2"])
+        >>> create_prices(watch_remnants, frozenset({"sku_1", "sku_2"}))
         [
             {
                 "id": "sku_1",
@@ -263,30 +235,32 @@ def create_prices(watch_remnants, offer_ids):
         ]
         
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
+    remnants = watch_remnants[watch_remnants["code"].isin(offer_ids)]
+    values = remnants["price"].astype(int)
+    prices = [
+        {
+            "id": code,
+            # "feed": {"id": 0},
+            "price": {
+                "value": value,
+                # "discountBase": 0,
+                "currencyId": "RUR",
+                # "vat": 0,
+            },
+            # "marketSku": 0,
+            # "shopSku": "string",
+        }
+        for code, value in zip(remnants["code"], values.tolist())
+    ]
     return prices
 
 
-async def upload_prices(watch_remnants, campaign_id, market_token):
+async def upload_prices(session, watch_remnants, campaign_id, market_token):
     """Загрузить цены на Яндекс Маркет.
 
     Args:
-        watch_remnants (list): Список словарей с информацией об оставшихся часов
+        session (aiohttp.ClientSession): HTTP-сессия
+        watch_remnants (pd.DataFrame): Остатки часов, подготовленные parse_remnants
         campaign_id (str): Идентификатор кампании
         market_token (str): Токен продавца
 
@@ -294,7 +268,7 @@ async def upload_prices(watch_remnants, campaign_id, market_token):
         list: Список цен, которые были загружены
 
     Examples:
-        >>> upload_prices(watch_remnants, "campaign_456", "market_token_789")
+        >>> await upload_prices(session, watch_remnants, "campaign_456", "market_token_789")
         [
             {
                 "id": "sku_1",
@@ -307,18 +281,25 @@ async def upload_prices(watch_remnants, campaign_id, market_token):
         ]
         
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
+    offer_ids = await get_offer_ids(session, campaign_id, market_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    await asyncio.gather(
+        *[
+            update_price(session, some_prices, campaign_id, market_token)
+            for some_prices in divide(prices, YM_PRICES_BATCH)
+        ]
+    )
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(
+    session, watch_remnants, campaign_id, market_token, warehouse_id
+):
     """Загрузить остатки на Яндекс Маркет
 
     Args:
-        watch_remnants (list): Список словарей с информацией об оставшихся часов
+        session (aiohttp.ClientSession): HTTP-сессия
+        watch_remnants (pd.DataFrame): Остатки часов, подготовленные parse_remnants
         campaign_id (str): Идентификатор кампании
         market_token (str): Токен продавца
         warehouse_id (int): Идентификатор склада
@@ -327,21 +308,22 @@ async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id)
         tuple: Кортеж, содержащий список непустых остатков и полный список остатков
 
     Examples:
-        >>> upload_stocks(watch_remnants, "campaign_456", "market_token_789", 1)
+        >>> await upload_stocks(session, watch_remnants, "campaign_456", "market_token_789", 1)
         (not_empty, stocks)
         
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
-    stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(
-        filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
+    offer_ids = await get_offer_ids(session, campaign_id, market_token)
+    stocks, not_empty = create_stocks(watch_remnants, offer_ids, warehouse_id)
+    await asyncio.gather(
+        *[
+            update_stocks(session, some_stock, campaign_id, market_token)
+            for some_stock in divide(stocks, YM_STOCKS_BATCH)
+        ]
     )
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     market_token = env.str("MARKET_TOKEN")
     campaign_fbs_id = env.str("FBS_ID")
@@ -349,32 +331,42 @@ def main():
     warehouse_fbs_id = env.str("WAREHOUSE_FBS_ID")
     warehouse_dbs_id = env.str("WAREHOUSE_DBS_ID")
 
-    watch_remnants = download_stock()
+    # Разбираем остатки один раз для обеих кампаний
+    watch_remnants = parse_remnants(download_stock())
     try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
-    except requests.exceptions.ReadTimeout:
+        session = await get_session()
+        await asyncio.gather(
+            # FBS
+            upload_stocks(
+                session,
+                watch_remnants,
+                campaign_fbs_id,
+                market_token,
+                warehouse_fbs_id,
+            ),
+            upload_prices(session, watch_remnants, campaign_fbs_id, market_token),
+            # DBS
+            upload_stocks(
+                session,
+                watch_remnants,
+                campaign_dbs_id,
+                market_token,
+                warehouse_dbs_id,
+            ),
+            upload_prices(session, watch_remnants, campaign_dbs_id, market_token),
+        )
+    except (requests.exceptions.ReadTimeout, asyncio.TimeoutError):
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except (
+        requests.exceptions.ConnectionError,
+        aiohttp.ClientConnectionError,
+    ) as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
+    finally:
+        await close_session()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,206 @@
+import asyncio
+import functools
+import logging.config
+import random
+
+import aiohttp
+import orjson
+
+logger = logging.getLogger(__file__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AdaptiveLimiter:
+    """Ограничить число одновременных запросов к API
+
+    Лимит растёт на единицу после каждого успешного запроса и уменьшается
+    вдвое, когда сервер сообщает о перегрузке.
+
+    Args:
+        max_concurrency (int): Максимальное число одновременных запросов
+        min_concurrency (int): Минимальное число одновременных запросов
+
+    Examples:
+        >>> limiter = AdaptiveLimiter(max_concurrency=16)
+        >>> async with limiter:
+        ...     await send_json(session, "POST", url, payload, headers)
+
+    """
+
+    def __init__(self, max_concurrency=16, min_concurrency=1):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def increase(self):
+        self.limit = min(self.max_concurrency, self.limit + 1)
+
+    def decrease(self):
+        self.limit = max(self.min_concurrency, self.limit // 2)
+
+
+LIMITER = AdaptiveLimiter(max_concurrency=32, min_concurrency=1)
+
+
+def retry_delay(error, attempt, base_delay, max_delay):
+    """Вычислить паузу перед повторным запросом
+
+    Args:
+        error (Exception): Ошибка, из-за которой запрос повторяется
+        attempt (int): Номер попытки, начиная с нуля
+        base_delay (float): Базовая пауза в секундах
+        max_delay (float): Максимальная пауза в секундах
+
+    Returns:
+        float: Пауза в секундах
+
+    Examples:
+        >>> retry_delay(error, 3, 1, 60)
+        8.42
+
+    """
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(max_delay, int(retry_after))
+    return min(max_delay, base_delay * 2**attempt) + random.uniform(0, base_delay)
+
+
+def with_retry(max_retries=8, base_delay=1, max_delay=60):
+    """Повторять запрос при перегрузке сервера и сетевых ошибках
+
+    Ответы 429 и 5xx, обрывы соединения и таймауты повторяются с
+    экспоненциальной паузой, одновременно снижая лимит LIMITER.
+
+    Args:
+        max_retries (int): Максимальное число повторов
+        base_delay (float): Базовая пауза в секундах
+        max_delay (float): Максимальная пауза в секундах
+
+    Returns:
+        function: Декоратор для асинхронной функции
+
+    Examples:
+        >>> @with_retry(max_retries=3)
+        ... async def send(session, url): ...
+
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(max_retries + 1):
+                try:
+                    async with LIMITER:
+                        result = await func(*args, **kwargs)
+                except (
+                    aiohttp.ClientResponseError,
+                    aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError,
+                ) as error:
+                    if attempt == max_retries or (
+                        isinstance(error, aiohttp.ClientResponseError)
+                        and error.status not in RETRY_STATUSES
+                    ):
+                        raise
+                    LIMITER.decrease()
+                    delay = retry_delay(error, attempt, base_delay, max_delay)
+                    logger.warning("Повтор запроса через %.1f с: %s", delay, error)
+                else:
+                    LIMITER.increase()
+                    return result
+                await asyncio.sleep(delay)
+
+        return wrapper
+
+    return decorator
+
+
+_SESSION = None
+
+
+async def get_session():
+    """Получить общую асинхронную HTTP-сессию процесса
+
+    Сессия создаётся при первом вызове. Один TCPConnector на весь процесс
+    переиспользует соединения, TLS-сессии и результаты DNS между всеми
+    запросами к Ozon и Яндекс Маркету.
+
+    Returns:
+        aiohttp.ClientSession: Сессия с пулом keep-alive соединений
+
+    Examples:
+        >>> session = await get_session()
+        >>> try:
+        ...     await upload_prices(session, watch_remnants, client_id, seller_token)
+        ... finally:
+        ...     await close_session()
+
+    """
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=32,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        _SESSION = aiohttp.ClientSession(
+            connector=connector,
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+    return _SESSION
+
+
+async def close_session():
+    """Закрыть общую HTTP-сессию и её соединения"""
+    global _SESSION
+    if _SESSION is not None:
+        await _SESSION.close()
+        _SESSION = None
+
+
+@with_retry(max_retries=8, base_delay=1)
+async def send_json(session, method, url, payload, headers, params=None):
+    """Отправить JSON-запрос и получить ответ сервера
+
+    Args:
+        session (aiohttp.ClientSession): HTTP-сессия
+        method (str): HTTP-метод запроса
+        url (str): Адрес запроса
+        payload (dict): Тело запроса, None для запроса без тела
+        headers (dict): Заголовки запроса
+        params (dict): Параметры строки запроса
+
+    Returns:
+        dict: Ответ сервера
+
+    Raises:
+        aiohttp.ClientResponseError: Если HTTP-запрос завершился неудачно
+
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        **headers,
+    }
+    data = None if payload is None else orjson.dumps(payload)
+    async with session.request(
+        method, url, data=data, headers=headers, params=params
+    ) as response:
+        response.raise_for_status()
+        return orjson.loads(await response.read())
@@ -1,20 +1,43 @@
+import asyncio
 import io
 import logging.config
-import os
 import re
 import zipfile
 from environs import Env
 
+import aiohttp
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+
+from net import close_session, get_session, send_json
 
 logger = logging.getLogger(__file__)
 
+# Повторный запуск в течение часа берёт архив остатков из кэша, а после
+# истечения срока кэш перепроверяется условным запросом (ETag/Last-Modified)
+SESSION = CachedSession("http_cache", expire_after=3600, cache_control=True)
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+_NON_DIGIT = re.compile(r"\D")
+
+_OZON_BASE = "https://api-seller.ozon.ru/"
+_PRODUCT_LIST_URL = _OZON_BASE + "v2/product/list"
+_PRICES_URL = _OZON_BASE + "v1/product/import/prices"
+_STOCKS_URL = _OZON_BASE + "v1/product/import/stocks"
+
+# Максимальное число товаров в одном запросе, допустимое API
+OZON_STOCKS_BATCH = 100
+OZON_PRICES_BATCH = 1000
+
 
-def get_product_list(last_id, client_id, seller_token):
+async def get_product_list(session, last_id, client_id, seller_token):
     """Получить список товаров магазина Ozon
 
     Args:
+        session(aiohttp.ClientSession): HTTP-сессия
         last_id(str): Идентификатор последнего полученного товара
         client_id(str): Идентификатор клиента
         seller_token(str): Токен продавца
@@ -23,15 +46,16 @@ def get_product_list(last_id, client_id, seller_token):
         dict: Возвращает словарь содержащий список товаров
         
     Raises:
-        requests.exceptions.HTTPError: Если HTTP-запрос завершился неудачно
+        aiohttp.ClientResponseError: Если HTTP-запрос завершился неудачно
         ValueError: Если обязательные параметры не переданы или имеют неверный тип
+        KeyError: Если ответ сервера не соответствует ожидаемой схеме
         
     Examples:
-        >>> get_product_list(last_id, client_id, seller_token)
+        >>> await get_product_list(session, last_id, client_id, seller_token)
         {"items": [...], "last_id": "123456", ...}
         
     """
-    url = "https://api-seller.ozon.ru/v2/product/list"
+    url = _PRODUCT_LIST_URL
     headers = {
         "Client-Id": client_id,
         "Api-Key": seller_token,
@@ -43,46 +67,43 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object.get("result")
+    response_object = await send_json(session, "POST", url, payload, headers)
+    return response_object["result"]
 
 
-def get_offer_ids(client_id, seller_token):
+async def get_offer_ids(session, client_id, seller_token):
     """Получить артикулы товаров магазина Ozon
     
     Args:
+        session (aiohttp.ClientSession): HTTP-сессия
         client_id (str): Идентификатор клиента
         seller_token (str): Токен продавца
 
     Returns:
-        list: Возвращает список артикулов товаров
+        frozenset: Возвращает множество артикулов товаров
 
     Examples:
-        >>> get_offer_ids(client_id, seller_token)
-        ["12345", "12346", ...]
+        >>> await get_offer_ids(session, client_id, seller_token)
+        frozenset({"12345", "12346", ...})
         
     """
     last_id = ""
     product_list = []
     while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
-        total = some_prod.get("total")
-        last_id = some_prod.get("last_id")
+        some_prod = await get_product_list(session, last_id, client_id, seller_token)
+        product_list.extend(some_prod["items"])
+        total = some_prod["total"]
+        last_id = some_prod["last_id"]
         if total == len(product_list):
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer_id"))
-    return offer_ids
+    return frozenset(product["offer_id"] for product in product_list)
 
 
-def update_price(prices: list, client_id, seller_token):
+async def update_price(session, prices: list, client_id, seller_token):
     """Обновить цены товаров
     
     Args:
+        session (aiohttp.ClientSession): HTTP-сессия
         prices (list): Список словарей с информацией о цене товара
         client_id (str): Идентификатор клиента
         seller_token (str): Токен продавца
@@ -91,29 +112,28 @@ def update_price(prices: list, client_id, seller_token):
         dict: Приходит ответ от сервера с ифнормацией о новых ценах
 
     Raises:
-        requests.exceptions.HTTPError: Если HTTP-запрос завершился неудачно
+        aiohttp.ClientResponseError: Если HTTP-запрос завершился неудачно
 
     Examples:
         >>> prices = [{"currency_code": "RUB", "offer_id": "12345", "price": "1000", ...}, ...]
-        >>> update_price(prices, client_id, seller_token)
+        >>> await update_price(session, prices, client_id, seller_token)
         {"result": {...}, ...}
         
     """
-    url = "https://api-seller.ozon.ru/v1/product/import/prices"
+    url = _PRICES_URL
     headers = {
         "Client-Id": client_id,
         "Api-Key": seller_token,
     }
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return await send_json(session, "POST", url, payload, headers)
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+async def update_stocks(session, stocks: list, client_id, seller_token):
     """Обновить остатки
     
     Args:
+        session (aiohttp.ClientSession): HTTP-сессия
         stocks (list): Список словарей с информацией об остатках
         client_id (str): Идентификатор клиента
         seller_token (str): Токен продавца
@@ -122,30 +142,28 @@ def update_stocks(stocks: list, client_id, seller_token):
         dict: Приходит ответ от сервера с информацией об обновлённых остатках
 
     Raises:
-        requests.exceptions.HTTPError: Если HTTP-запрос завершился неудачно
+        aiohttp.ClientResponseError: Если HTTP-запрос завершился неудачно
 
     Examples:
         >>> stocks = [{"offer_id": "12345", "stock": 100}, ...]
-        >>> update_stocks(stocks, client_id, seller_token)
+        >>> await update_stocks(session, stocks, client_id, seller_token)
         {"result": {...}, ...}
         
     """
-    url = "https://api-seller.ozon.ru/v1/product/import/stocks"
+    url = _STOCKS_URL
     headers = {
         "Client-Id": client_id,
         "Api-Key": seller_token,
     }
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return await send_json(session, "POST", url, payload, headers)
 
 
 def download_stock():
     """Скачать файл ostatki с сайта casio
     
     Returns:
-        list: Список словарей с информацией об остатках
+        pd.DataFrame: Таблица с информацией об остатках
 
     Raises:
         requests.exceptions.HTTPError: Если HTTP-запрос завершился неудачно
@@ -153,68 +171,97 @@ def download_stock():
 
     Examples:
         >>> download_stock()
-        [{"Код": "123456", "Количество": "5", ...}, ...]
+                Код Количество            Цена ...
+        0    123456          5  5'990.00 руб. ...
         
     """
     # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
-    response.raise_for_status()
-    with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+    archive_file = io.BytesIO()
+    with SESSION.get(casio_url, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            archive_file.write(chunk)
+    archive_file.seek(0)
+    # Создаем таблицу остатков часов, не распаковывая архив на диск:
+    with zipfile.ZipFile(archive_file) as archive:
+        with archive.open("ostatki.xls") as excel_file:
+            watch_remnants = pd.read_excel(
+                io=excel_file,
+                engine="calamine",
+                usecols=["Код", "Количество", "Цена"],
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+            )
     return watch_remnants
 
 
+def parse_remnants(watch_remnants):
+    """Подготовить остатки часов к выгрузке на маркетплейсы
+
+    Артикул, остаток и цена вычисляются один раз для всей таблицы, чтобы
+    не повторять разбор для каждой кампании и каждого склада.
+
+    Args:
+        watch_remnants (pd.DataFrame): Таблица с информацией об оставшихся часах
+
+    Returns:
+        pd.DataFrame: Таблица со столбцами code, stock и price
+
+    Examples:
+        >>> parse_remnants(download_stock())
+             code  stock  price
+        0  123456      5   5990
+        ...
+
+    """
+    return pd.DataFrame(
+        {
+            "code": watch_remnants["Код"].astype(str),
+            "stock": stock_conversion(watch_remnants["Количество"]),
+            "price": prices_conversion(watch_remnants["Цена"]),
+        }
+    )
+
+
 def create_stocks(watch_remnants, offer_ids):
     """Создать список остатков для обновления
 
     Args:
-        watch_remnants (list): Список словарей с информацией об оставшихся часов
-        offer_ids (list): Список артикулов товаров
+        watch_remnants (pd.DataFrame): Остатки часов, подготовленные parse_remnants
+        offer_ids (frozenset): Множество артикулов товаров
 
     Returns:
-        list: Список словарей с информацией об остатках
+        tuple: Кортеж, содержащий полный список остатков и список непустых остатков
 
     Examples:
         >>> create_stocks(watch_remnants, offer_ids)
-        [{"offer_id": "123456", "stock": 50}, ...]
+        ([{"offer_id": "123456", "stock": 50}, ...], [...])
         
     """
     # Уберем то, что не загружено в seller
+    remnants = watch_remnants[watch_remnants["code"].isin(offer_ids)]
+    remnants = remnants.drop_duplicates("code")
     stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
+    not_empty = []
+    for code, count in zip(remnants["code"], remnants["stock"].tolist()):
+        stock = {"offer_id": code, "stock": count}
+        stocks.append(stock)
+        if count != 0:
+            not_empty.append(stock)
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
+    for offer_id in offer_ids.difference(remnants["code"]):
         stocks.append({"offer_id": offer_id, "stock": 0})
-    return stocks
+    return stocks, not_empty
 
 
 def create_prices(watch_remnants, offer_ids):
     """Создать список цен
 
     Args:
-        watch_remnants (list): Список словарей с информацией об оставшихся часов
-        offer_ids (list): Список артикулов товаров
+        watch_remnants (pd.DataFrame): Остатки часов, подготовленные parse_remnants
+        offer_ids (frozenset): Множество артикулов товаров
 
     Returns:
         list: Список словарей с информацией о ценах
@@ -224,17 +271,17 @@ def create_prices(watch_remnants, offer_ids):
         [{"offer_id": "123456", "price": "5000", ...}, ...]
         
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
+    remnants = watch_remnants[watch_remnants["code"].isin(offer_ids)]
+    prices = [
+        {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": code,
+            "old_price": "0",
+            "price": price,
+        }
+        for code, price in zip(remnants["code"], remnants["price"])
+    ]
     return prices
 
 
@@ -253,7 +300,43 @@ def price_conversion(price: str) -> str:
         5990
         
     """
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    return _NON_DIGIT.sub("", price.partition(".")[0])
+
+
+def prices_conversion(prices: pd.Series) -> pd.Series:
+    """Преобразовать столбец цен. Пример: 5'990.00 руб. -> 5990
+
+    Args:
+        prices (pd.Series): цены для преобразования
+    Returns:
+        pd.Series: преобразованные цены без лишних символов
+    Examples:
+        >>>prices_conversion(pd.Series(["5'990.00 руб.", "12'500.00 руб."]))
+        0     5990
+        1    12500
+        dtype: object
+
+    """
+    return prices.astype(str).str.partition(".")[0].str.replace(
+        _NON_DIGIT, "", regex=True
+    )
+
+
+def stock_conversion(counts: pd.Series) -> np.ndarray:
+    """Преобразовать столбец остатков. Пример: ">10" -> 100, "1" -> 0
+
+    Args:
+        counts (pd.Series): остатки для преобразования
+    Returns:
+        np.ndarray: остатки в виде целых чисел
+    Examples:
+        >>>stock_conversion(pd.Series([">10", "1", "5"]))
+        array([100,   0,   5])
+
+    """
+    counts = counts.astype(str)
+    numeric = pd.to_numeric(counts, errors="coerce").fillna(0).astype(int)
+    return np.where(counts == ">10", 100, np.where(counts == "1", 0, numeric))
 
 
 def divide(lst: list, n: int):
@@ -263,23 +346,28 @@ def divide(lst: list, n: int):
         lst (list): Список для разделения
         n (int): Количество элементов в каждой части
 
-    Returns:
-        list: Список разбитый на части по n элементов
+    Yields:
+        list: Очередная часть списка из n элементов. Части создаются по
+        одной, поэтому генератор не нужно превращать в список целиком
 
     Examples:
-        >>> divide([1, 2, 3, 4, 5], 2)
-        [[1, 2], [3, 4], [5]]
+        >>> for part in divide([1, 2, 3, 4, 5], 2):
+        ...     print(part)
+        [1, 2]
+        [3, 4]
+        [5]
         
     """
     for i in range(0, len(lst), n):
         yield lst[i : i + n]
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+async def upload_prices(session, watch_remnants, client_id, seller_token):
     """Загрузить цены на сайт Ozon
 
     Args:
-        watch_remnants (list): Список словарей с информацией об оставшихся часов
+        session (aiohttp.ClientSession): HTTP-сессия
+        watch_remnants (pd.DataFrame): Остатки часов, подготовленные parse_remnants
         client_id (str): Идентификатор клиента
         seller_token (str): Токен продавца
 
@@ -287,22 +375,27 @@ async def upload_prices(watch_remnants, client_id, seller_token):
         list: Список цен, которые были загружены
 
     Examples:
-        >>> upload_prices(watch_remnants, client_id, seller_token)
+        >>> await upload_prices(session, watch_remnants, client_id, seller_token)
         [{"offer_id": "123456", "price": "5000", ...}, ...]
         
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
+    offer_ids = await get_offer_ids(session, client_id, seller_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    await asyncio.gather(
+        *[
+            update_price(session, some_price, client_id, seller_token)
+            for some_price in divide(prices, OZON_PRICES_BATCH)
+        ]
+    )
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(session, watch_remnants, client_id, seller_token):
     """Загрузить остатки на сайт Ozon
 
     Args:
-        watch_remnants (list): Список словарей с информацией об оставшихся часов
+        session (aiohttp.ClientSession): HTTP-сессия
+        watch_remnants (pd.DataFrame): Остатки часов, подготовленные parse_remnants
         client_id (str): Идентификатор клиента
         seller_token (str): Токен продавца
 
@@ -310,39 +403,60 @@ async def upload_stocks(watch_remnants, client_id, seller_token):
         tuple: Кортеж, содержащий список остатков и список обновленных остатков
 
     Examples:
-        >>> upload_stocks(watch_remnants, client_id, seller_token)
+        >>> await upload_stocks(session, watch_remnants, client_id, seller_token)
         (not_empty, stocks)
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
-    stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
-    not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
+    offer_ids = await get_offer_ids(session, client_id, seller_token)
+    stocks, not_empty = create_stocks(watch_remnants, offer_ids)
+    await asyncio.gather(
+        *[
+            update_stocks(session, some_stock, client_id, seller_token)
+            for some_stock in divide(stocks, OZON_STOCKS_BATCH)
+        ]
+    )
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
     try:
-        offer_ids = get_offer_ids(client_id, seller_token)
-        watch_remnants = download_stock()
+        session = await get_session()
+        # Пока выгружаются артикулы, скачиваем остатки в отдельном потоке
+        offer_ids, watch_remnants = await asyncio.gather(
+            get_offer_ids(session, client_id, seller_token),
+            asyncio.to_thread(download_stock),
+        )
+        watch_remnants = parse_remnants(watch_remnants)
         # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
+        stocks, _ = create_stocks(watch_remnants, offer_ids)
+        await asyncio.gather(
+            *[
+                update_stocks(session, some_stock, client_id, seller_token)
+                for some_stock in divide(stocks, OZON_STOCKS_BATCH)
+            ]
+        )
         # Поменять цены
         prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
-    except requests.exceptions.ReadTimeout:
+        await asyncio.gather(
+            *[
+                update_price(session, some_price, client_id, seller_token)
+                for some_price in divide(prices, OZON_PRICES_BATCH)
+            ]
+        )
+    except (requests.exceptions.ReadTimeout, asyncio.TimeoutError):
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except (
+        requests.exceptions.ConnectionError,
+        aiohttp.ClientConnectionError,
+    ) as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
+    finally:
+        await close_session()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())